@@ -4,19 +4,53 @@ Implementation of the WFC bitmap-based procedural image generation algorithm;
 this module runs the entire algorithm from start to finish, with an optional
 path to the input and output image.
 """
+import multiprocessing as mp
+import numpy as np
+
 import wfc_setup
 import wfc_core
 import wfc_visual
 
 
+def _generate(task: tuple[tuple[np.ndarray, np.ndarray], np.ndarray, int, int, int]) -> np.ndarray:
+    """Generate and return a wave without visualization, given a tuple of the adjacency and
+    frequency rules, tile palette, width, height, and the seed of the random number generator.
+    Used by the worker processes of main.
+    """
+    rules, palette, w, h, seed = task
+    np.random.seed(seed)
+    vis = wfc_visual.Visual(w, h, palette, flag='off')
+    return wfc_core.Core(rules, w, h, vis).generate()
+
+
+def _generate_parallel(task: tuple[tuple[np.ndarray, np.ndarray], np.ndarray, int, int], procs: int) -> np.ndarray:
+    """Generate and return a wave without visualization, given a tuple of the adjacency and
+    frequency rules, tile palette, width and height, by generating in procs worker processes
+    with their own random seeds and keeping the first wave to be completed.
+
+    Preconditions:
+        - procs > 1
+    """
+    seeds = np.random.SeedSequence().generate_state(procs)
+    # the remaining workers are terminated upon leaving the pool
+    with mp.Pool(procs) as pool:
+        return next(pool.imap_unordered(_generate, [task + (s,) for s in seeds]))
+
+
 def main(in_: str = 'images/demo.png', out: str = 'outpot/demo_out.png',
-         n: int = 2, w: int = 30, h: int = 30, flag: str = 'auto') -> None:
+         n: int = 2, w: int = 30, h: int = 30, flag: str = 'auto', procs: int = 1) -> None:
     """The main function running the WFC algorithm. Accepts optional
     parameters representing input image, output image location, and size
     of tiles to be extracted, as well as height h and width w as
     dimensions for the output image. It additionally accepts a flag
     indicating the form of visaulization desired during generation.
 
+    If procs > 1, that many worker processes generate the wave independently
+    with their own random seeds, and the first wave to be completed is kept.
+    As generation may backtrack at length (or restart altogether) on
+    contradiction, this reduces the time spent on unlucky attempts. Waves
+    generated this way are not visualized, so flag is then treated as 'off'.
+
     Preconditions:
         - in_ is a valid image path
         - n > 0
@@ -24,23 +58,28 @@ def main(in_: str = 'images/demo.png', out: str = 'outpot/demo_out.png',
         - h > 0
         - flag in {'off', 'manual', 'auto'}
         - debug or flag != 'off'
+        - procs > 0
     """
     # load up data and rules
-    tileid, tileset = wfc_setup.extract(in_, n)
-    adj, freq = wfc_setup.gen_rules(tileset)
-    # generate and visualize
-    vis = wfc_visual.Visual(w, h, tileid, flag=flag)
-    core = wfc_core.Core(adj, freq, w, h, vis)
-    wave = core.generate()
+    palette, tileset = wfc_setup.extract(in_, n)
+    rules = wfc_setup.gen_rules(tileset)
+    if procs > 1:
+        # generate in parallel, keeping the first wave to be completed
+        wave = _generate_parallel((rules, palette, w, h), procs)
+    else:
+        # generate and visualize
+        vis = wfc_visual.Visual(w, h, palette, flag=flag)
+        core = wfc_core.Core(rules, w, h, vis)
+        wave = core.generate()
     # produce an output image
-    wfc_visual.render(out, tileid, wave)
+    wfc_visual.render(out, palette, wave)
 
 
 if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'extra-imports': ['wfc_setup', 'wfc_core', 'wfc_visual'],
+        'extra-imports': ['multiprocessing', 'numpy', 'wfc_setup', 'wfc_core', 'wfc_visual'],
         'allowed-io': [],
         'max-line-length': 120
     })
@@ -9,95 +9,418 @@ adjacency and frequency data.
 
 Copyright 2024, Stefan Barna, All rights reserved.
 """
-import heapq
 from collections import deque
+from functools import lru_cache
+from typing import Callable
 import numpy as np
+from numba import literally, njit
 
-from wfc_graph import Graph
-from wfc_utilities import get_neighbours
+from wfc_utilities import pack_bits, unpack_bits, popcount, neighbour_table
 from wfc_visual import Visual
 
+# NOTE: bitset arithmetic in the compiled functions below must use uint64 operands throughout,
+# as numba promotes mixed signed and unsigned 64-bit integer arithmetic to floating point.
+_ONE = np.uint64(1)
+
+# The number of backtracks allowed since the wave was last closer to collapse than ever before,
+# after which the wave is reset. Backtracking only reaches the latest collapses, and so rarely
+# recovers once it stops making progress; starting over is then far cheaper.
+_BUDGET = 4
+
+
+@njit(cache=True)
+def _popcount(bits: np.ndarray) -> int:
+    """Return the number of set bits in the input bitset."""
+    count = 0
+    for k in range(bits.size):
+        x = bits[k]
+        while x != 0:
+            x &= x - _ONE
+            count += 1
+    return count
+
+
+@njit(cache=True)
+def _enqueue(wave: np.ndarray, buffers: tuple, queue: tuple, size: int, cell: tuple[int, int]) -> int:
+    """Push every uncollapsed neighbour of the input cell onto the fringe, unless it is already
+    there, flagging in pending the direction of the neighbour in which the cell lies.
+    Return the new size of the fringe.
+
+    The tuple buffers holds the arrays nb_i, nb_j, dirty and old (see propagate), and queue holds
+    the fringe and pending.
+    """
+    nb_i, nb_j = buffers[0], buffers[1]
+    fringe, pending = queue
+    i, j = cell
+    for d in range(4):
+        ni, nj = nb_i[i, j, d], nb_j[i, j, d]
+        if _popcount(wave[ni, nj]) > 1:
+            if pending[ni, nj] == 0:
+                fringe[size, 0], fringe[size, 1] = ni, nj
+                size += 1
+            # the cell lies in direction d ^ 1 of the neighbour (e.g. RIGHT if LEFT)
+            pending[ni, nj] |= 1 << (d ^ 1)
+    return size
+
+
+@njit(cache=True)
+def _support(wave: np.ndarray, tables: tuple, cell: tuple[int, int], words: int) -> None:
+    """Recompute the support of the input cell from its states, where tables holds the arrays
+    allowed and sup: sup[i, j, d] is the union of the tiles permitted in direction d of each
+    tile cell i, j may collapse to.
+
+    The function is compiled separately for every number of words, as for _propagator.
+
+    Preconditions:
+        - wave.shape[2] == words
+    """
+    literally(words)
+    allowed, sup = tables
+    i, j = cell
+    for d in range(4):
+        for m in range(words):
+            sup[i, j, d, m] = 0
+    for k in range(words):
+        x = wave[i, j, k]
+        b = 64 * k
+        while x != 0:
+            # skip ahead to the lowest set bit of x, that of the tile with index b
+            while x & _ONE == 0:
+                x >>= _ONE
+                b += 1
+            for n in range(4 * words):
+                d, m = n // words, n % words
+                sup[i, j, d, m] |= allowed[d, b, m]
+            x >>= _ONE
+            b += 1
+
+
+@njit(cache=True)
+def _refresh(wave: np.ndarray, tables: tuple, cells: np.ndarray, words: int) -> None:
+    """Recompute the support of every cell in cells from its states.
+
+    Preconditions:
+        - wave.shape[2] == words
+    """
+    literally(words)
+    for k in range(cells.shape[0]):
+        _support(wave, tables, (cells[k, 0], cells[k, 1]), words)
+
+
+@njit(cache=True, inline='always')
+def _reduce(wave: np.ndarray, tables: tuple, buffers: tuple, cell: tuple[int, int, int], words: int) -> bool:
+    """Reduce the states of cell i, j in place, where cell is the triple i, j, flags, by intersecting
+    them with the supports of its neighbours in every direction d such that bit d of flags is set.
+    Return whether the states of the cell have changed.
+
+    The function is inlined where it is called, as a call per reduced cell is costly; the number
+    of words is then the literal of the caller.
+
+    Preconditions:
+        - wave.shape[2] == words
+    """
+    sup = tables[1]
+    nb_i, nb_j = buffers[0], buffers[1]
+    i, j, flags = cell
+    changed = False
+    for m in range(words):
+        x = wave[i, j, m]
+        for d in range(4):
+            if flags & (1 << d):
+                x &= sup[nb_i[i, j, d], nb_j[i, j, d], d, m]
+        changed |= x != wave[i, j, m]
+        wave[i, j, m] = x
+    return changed
+
+
+@njit(cache=True)
+def _restore(wave: np.ndarray, tables: tuple, buffers: tuple, count: int, words: int) -> None:
+    """Restore each of the first count cells in dirty to its states in the same row of old, and
+    recompute the supports of these cells.
+
+    Preconditions:
+        - wave.shape[2] == words
+    """
+    literally(words)
+    dirty, old = buffers[2], buffers[3]
+    for k in range(count):
+        wave[dirty[k, 0], dirty[k, 1]] = old[k]
+    _refresh(wave, tables, dirty[:count], words)
+
+
+# NOTE: the function returned by _propagator must close over nothing but the number of words,
+# and so calls the helpers above as globals, passing them the number of words as a literal.
+# Numba keys its on-disk cache of a closure on the values it closes over, which for another
+# compiled function differ in every process.
+@lru_cache(maxsize=None)
+def _propagator(words: int) -> Callable:
+    """Return the propagation function for bitsets of the given number of 64-bit words.
+
+    The number of words is a compile-time constant of the returned function, so that its loops
+    over the words of a bitset are fully unrolled, and the bitsets kept in registers.
+    """
+    @njit(cache=True)
+    def propagate(wave: np.ndarray, tables: tuple, buffers: tuple, cell: tuple[int, int]) -> int:
+        """Propagate a change in the states of the input cell (such as its collapse) throughout the
+        wave, reducing the states of every affected cell based on its neighbours. The coordinates
+        of every cell whose states are reduced are written, once each, to the leading rows of dirty,
+        and the states of the cell prior to this call to the same row of old. Return the number of
+        such cells, or -1 if there is a contradiction, in which case the wave is left unchanged.
+
+        The tuples tables and buffers hold the arrays allowed, sup and nb_i, nb_j, dirty, old, as
+        stored on Core. The support in sup of every cell other than the input cell must be up to date.
+
+        Preconditions:
+            - 0 <= cell[0] < wave.shape[0]
+            - 0 <= cell[1] < wave.shape[1]
+            - buffers[2].shape == (wave.shape[0] * wave.shape[1], 2)
+            - buffers[3].shape == (wave.shape[0] * wave.shape[1], words)
+            - wave.shape[2] == words
+        """
+        dirty, old = buffers[2], buffers[3]
+        # The fringe is a stack of cells to be reduced. A cell is never in the fringe twice at once,
+        # so it holds at most h * w cells. Bit d of pending[i, j] is set if cell i, j is in the
+        # fringe and its neighbour in direction d has changed since, so that only the supports of
+        # the changed neighbours are read when the cell is reduced.
+        fringe = np.empty((wave.shape[0] * wave.shape[1], 2), np.int32)
+        pending = np.zeros(wave.shape[:2], np.uint8)
+        seen = np.zeros(wave.shape[:2], np.bool_)
+        ndirty = 0
+
+        # add all neighbours to the collapsed cell to the stack of affected cells
+        # if they are not already collapsed themselves
+        _support(wave, tables, cell, words)
+        size = _enqueue(wave, buffers, (fringe, pending), 0, cell)
+
+        # propagate the collapse to each neighbouring tile while there is anything to propagate
+        while size > 0:
+            size -= 1
+            i, j = fringe[size, 0], fringe[size, 1]
+            flags = pending[i, j]
+            pending[i, j] = 0
+
+            # update the possible states of the cell based on its changed neighbours, keeping its
+            # prior states in the next row of old in case this is its first reduction
+            for m in range(words):
+                old[ndirty, m] = wave[i, j, m]
+            # if the states of the cell have not changed, there is nothing further to propagate
+            if not _reduce(wave, tables, buffers, (i, j, flags), words):
+                continue
+
+            if not seen[i, j]:
+                seen[i, j] = True
+                dirty[ndirty, 0], dirty[ndirty, 1] = i, j
+                ndirty += 1
+
+            # Check that a contradiction has not occurred (i.e. the number of states
+            # that the cell may collapse to is 0). If it has, undo every reduction.
+            if _popcount(wave[i, j]) == 0:
+                _restore(wave, tables, buffers, ndirty, words)
+                return -1
+
+            # NOTE that the same cell may be reduced more than once during a single propagation phase.
+            # This is intentional -- the change in a neighbour during propagation may change a cell,
+            # which in turn may again affect the neighbour!
+            _support(wave, tables, (i, j), words)
+            size = _enqueue(wave, buffers, (fringe, pending), size, (i, j))
+        return ndirty
+
+    return propagate
+
+
+class _Frame:
+    """A record of the changes made to the wave since the collapse of a cell, such that
+    the collapse may be undone. Changes are delta-encoded: only the reduced cells are
+    stored, along with their states prior to reduction.
+
+    Instance Attributes:
+        - cell: the collapsed cell
+        - states: the bitset of the cell prior to its collapse
+        - tile: the index of the tile the cell collapsed to
+        - uncollapsed: the number of uncollapsed cells in the wave prior to the collapse
+        - changes: the reductions made since the collapse, in order, each as an array of the
+            reduced cells and an array of their bitsets prior to reduction
+    """
+    cell: tuple[int, int]
+    states: np.ndarray
+    tile: int
+    uncollapsed: int
+    changes: list[tuple[np.ndarray, np.ndarray]]
+
+    def __init__(self, cell: tuple[int, int], states: np.ndarray, tile: int, uncollapsed: int) -> None:
+        """Initialize a new frame for the collapse of cell from the given states to the given tile."""
+        self.cell = cell
+        self.states = states
+        self.tile = tile
+        self.uncollapsed = uncollapsed
+        self.changes = []
+
+
+class _Search:
+    """The state of the search for a fully collapsed wave: the order in which uncollapsed cells
+    are to be collapsed, and the latest collapses, so that they may be undone.
+
+    Instance Attributes:
+        - buckets: the uncollapsed cells, such that buckets[c] lists cells pushed with c states
+        - min_bucket: a lower bound on the index of the first nonempty bucket
+        - stack: the frames of the most recent collapses, the latest last
+        - best: the fewest uncollapsed cells reached since the wave was last reset
+        - budget: the number of backtracks left before the wave is reset, unless best is lowered
+    """
+    buckets: list[list[tuple[int, int]]]
+    min_bucket: int
+    stack: deque[_Frame]
+    best: int
+    budget: int
+
+    def __init__(self, depth: int) -> None:
+        """Initialize a new search state, keeping at most depth frames."""
+        self.buckets = []
+        self.min_bucket = 0
+        self.stack = deque(maxlen=depth)
+        self.best = 0
+        self.budget = _BUDGET
+
 
 class Core:
     """
-    The WFC core. Handles image generation given an adjacency graph, frequnecy rules, and
+    The WFC core. Handles image generation given adjacency rules, frequnecy rules, and
     desired dimensions of the output file.
 
+    Cell states are stored as bitsets: tile IDs are the dense indices 0, ..., T - 1, and bit k
+    of self._wave[i, j] is set if and only if the tile with ID k is feasible for cell i, j.
+
     NOTE: As stated in the representation inveriants, all tiles must be registered both in
-    the frequency distribution and as a vertex in the adjacency graph.
+    the frequency distribution and in the adjacency rules.
+
+    Cells are collapsed in order of their number of remaining states (fewest first), with ties
+    broken at random. Uncollapsed cells are kept in buckets by their number of states; entries
+    are not removed when a cell is reduced further, but skipped when they are popped.
+
+    When a collapse leads to a contradiction, it is undone and the tile it chose is forbidden
+    for the cell. If this leads to a contradiction in turn, the collapse before it is undone,
+    and so on, up to a fixed number of the most recent collapses. The wave is reset if there is
+    no collapse left to undo, or once _BUDGET backtracks have passed since the number of
+    uncollapsed cells last reached a new minimum.
 
     Representation Invariants:
-        - self._wave[i, j] stores a list of all tileIDs feasible for cell i, j, or is None if
-            cell i, j may take on any tileID (i.e. is unrestricted)
-        - all(key in self._adj._vertices for key in freq)
-        - all(key in freq for key in self._adj._vertices)
+        - self._wave[i, j] is a bitset of all tile indices feasible for cell i, j; an unrestricted
+            cell has all of its self._freq.size bits set
+        - self._tables[0].shape == (4, self._freq.size, self._wave.shape[2])
+        - self._wave.shape[2] == ceil(self._freq.size / 64)
     """
     # Instance Attributes:
-    #     - _wave: the output "wave" -- a grid storing cell states as tile IDs
+    #     - _wave: the output "wave" -- a grid storing cell states as bitsets of tile indices
     #     - _uncollapsed: the number of uncollapsed tiles in the generated output
-    #     - _adj: the adjacency graph storing information regarding which tiles may be adjacent
-    #     - _freq: the frequency distribution of tiles within the adjacency graph
+    #     - _freq: the frequency distribution of tiles, indexed by tile ID
+    #     - _tables: the bitset tables allowed and sup, where allowed[d, k] stores the tiles that
+    #         may lie in direction d of the tile with index k, and sup[i, j, d] is the support of
+    #         cell i, j -- the union of allowed[d, k] over the tiles k that the cell may collapse to
+    #     - _buffers: the arrays nb_i and nb_j, storing the neighbours of every cell as given by
+    #         neighbour_table, and dirty and old, receiving the cells reduced by each propagation
+    #         and their bitsets prior to reduction
     #     - _visual: the Visual used for graphically representing the wave during generation
-    #     - _entropyq: a min heap storing wave cells of lowest entropy
+    #     - _search: the buckets of uncollapsed cells and the frames of the latest collapses
     _wave: np.ndarray
     _uncollapsed: int
-    _adj: Graph
-    _freq: dict
+    _freq: np.ndarray
+    _tables: tuple[np.ndarray, np.ndarray]
+    _buffers: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
     _visual: Visual
-    _entropyq: list
+    _search: _Search
 
     # NOTE: all functions in this class are PRIVATE with the exception of generate(). They are
     # not meant to be called by any external functions or scripts.
-    def __init__(self, adj: Graph, freq: dict, w: int, h: int, vis: Visual) -> None:
+    def __init__(self, rules: tuple[np.ndarray, np.ndarray], w: int, h: int, vis: Visual, depth: int = 64) -> None:
         """Initialize a new core to generate an array of size w x h storing the ID of tiles in the output.
-            - adj is a directed weighted multigraph that permits loops, storing permitted tile adjacencies.
+            - rules is the pair allowed, freq storing permitted tile adjacencies as bitsets and the
+                frequency of every tile, as produced by wfc_setup.gen_rules.
             - w and h specify the dimensions of the output image.
             - vis is a visualizer for the wave during generation
+            - depth is the maximum number of collapses that may be undone on contradiction
 
         Preconditions:
             - w > 0
             - h > 0
+            - depth >= 0
         """
-        # Initialize the output array with None entries -- entries that are None represent regions
-        # of the wave with the default entropy (that is, their entropy has not been reduced by
-        # the collapse of nearby cells). This is to reduce memory cost of storing the possible
-        # states of each cell.
-        self._adj = adj
-        self._freq = freq
+        allowed, self._freq = rules
         self._visual = vis
-        self._wave = np.ndarray((h, w), set)
-        self._uncollapsed = w * h
-        self._entropyq = []
 
-    def __entropy(self, cell: tuple[int, int]) -> float:
-        """Compute and return the entropy of the input cell.
-        The entropy of a cell is given by the formula
-            log(W) - (w1*log(w1) + ... + wn*log(wn)) / W
-        where w1, ..., wn are the weights corresponding to each tile the current
-        cell may collapse to, and W = w1 + ... + wn.
+        words = allowed.shape[2]
+        self._wave = np.empty((h, w, words), np.uint64)
+        self._tables = (allowed, np.empty((h, w, 4, words), np.uint64))
+        self._buffers = neighbour_table(h, w) + (np.empty((h * w, 2), np.int32), np.empty((h * w, words), np.uint64))
+        self._search = _Search(depth)
+        self.__reset()
+
+    def __reset(self) -> None:
+        """Reset the wave so that every cell is unrestricted -- all bits are set, as these regions
+        of the wave have the default entropy (that is, their entropy has not been reduced by the
+        collapse of nearby cells).
+        """
+        h, w = self._wave.shape[0], self._wave.shape[1]
+        allowed, sup = self._tables
+        self._wave[...] = pack_bits(np.ones(self._freq.size, bool))
+        sup[...] = np.bitwise_or.reduce(allowed, axis=1)
+        self._uncollapsed = w * h
+        search = self._search
+        search.buckets = [[] for _ in range(self._freq.size + 1)]
+        search.buckets[-1] = [(i, j) for i in range(h) for j in range(w)]
+        search.min_bucket = self._freq.size
+        search.stack.clear()
+        search.best = w * h
+        search.budget = _BUDGET
 
-        Return np.nan if the current cell is unrestricted, and may collapse to any
-        tile in self._adj. Note that a collapsed cell will return entropy 0 using
-        the formula listed above.
+    def __states(self, cell: tuple[int, int]) -> np.ndarray:
+        """Return the indices of all tiles the input cell may collapse to, in ascending order.
 
         Preconditions:
             - 0 < cell[0] < self._wave.shape[0]
             - 0 < cell[1] < self._wave.shape[1]
         """
-        # If this cell can occupy any state, we return np.nan, representing that
-        # the entropy is the largest it can possibly be. This is to prevent the
-        # unnecessary computations involved for unrestricted cells.
-        if self._wave[cell] is None:
-            return np.nan
-        # Otherwise, we compute the entropy of this cell based on possible tiles
-        # it may collapse to, with weights as specified in the frequency dist.
-        else:
-            tw = 0  # total weight
-            logw = 0  # logarithmic weight
-            for state in self._wave[cell]:
-                tw += self._freq[state]
-                logw += self._freq[state] * np.log2(self._freq[state])
-            return np.log2(tw) - (logw / tw)
+        return np.flatnonzero(unpack_bits(self._wave[cell], self._freq.size))
+
+    def __pop(self) -> tuple[int, int]:
+        """Pop and return a random uncollapsed cell with the fewest possible states from the buckets.
+
+        Preconditions:
+            - self._uncollapsed > 0
+        """
+        search = self._search
+        while search.min_bucket < len(search.buckets):
+            bucket = search.buckets[search.min_bucket]
+            # advance to the next bucket once this one is exhausted
+            if len(bucket) == 0:
+                search.min_bucket += 1
+                continue
+            # swap a random entry to the end of the bucket so that it may be popped in constant time
+            k = np.random.randint(len(bucket))
+            bucket[k], bucket[-1] = bucket[-1], bucket[k]
+            cell = bucket.pop()
+            # It is possible that a stale entry exists in the bucket, as the cell may have been
+            # reduced (or collapsed) since it was pushed. We must therefore account for this.
+            if popcount(self._wave[cell]) == search.min_bucket:
+                return cell
+        # every bucket is exhausted, so there is no uncollapsed cell
+        raise ValueError
+
+    def __push(self, cells: np.ndarray, counts: np.ndarray) -> None:
+        """Push every uncollapsed cell in cells to the bucket of its number of states, where
+        counts[k] is the number of states of cells[k].
+        """
+        search = self._search
+        for cell, count in zip(map(tuple, cells.tolist()), counts.tolist()):
+            if count > 1:
+                search.buckets[count].append(cell)
+                search.min_bucket = min(search.min_bucket, count)
+
+    def __record(self, cells: np.ndarray, states: np.ndarray) -> None:
+        """Record the reduction of the input cells from the input states in the latest frame, if any.
+        If there is none, the reduction is permanent until the wave is reset.
+        """
+        if len(self._search.stack) > 0:
+            self._search.stack[-1].changes.append((cells, states))
 
     def __collapse(self, cell: tuple[int, int]) -> None:
         """Collapses the input cell to a fixed tile on the wave (grid).
@@ -108,124 +431,115 @@ class Core:
        Preconditions:
             - 0 < cell[0] < self._wave.shape[0]
             - 0 < cell[1] < self._wave.shape[1]
-            - self._wave[cell] is None or len(self._wave[cell]) > 1
+            - popcount(self._wave[cell]) > 1
         """
+        # limit the distribution to the possible states the cell may collapse to; an
+        # unrestricted cell has all bits set, so this is then the full frequency distribution
+        states = self.__states(cell)
+        # sample from the cumulative distribution of the weights, which avoids the per-call
+        # validation and normalization overhead of np.random.choice on such small arrays
+        cumulative = np.cumsum(self._freq[states])
+        chosen = states[np.searchsorted(cumulative, np.random.random() * cumulative[-1], side='right')]
+        # open a new frame, so that this collapse may be undone
+        self._search.stack.append(_Frame(cell, self._wave[cell].copy(), chosen, self._uncollapsed))
         self._uncollapsed -= 1
-        # if the cell may collapse to ANY state, use the full frequency distribution
-        if self._wave[cell] is None:
-            states = list(self._freq.keys())
-        # otherwise, limit the distribution to the possible states it may collapse to
-        else:
-            states = list(self._wave[cell])
-        # NOTE: we cast states to a list as we need element order for choice function.
-        # Now, regardless of how the states are determined, we collapse the cell.
-        weights = [self._freq[s] for s in states]
-        tw = sum(weights)
-        self._wave[cell] = set(np.random.choice(states, 1, p=[w / tw for w in weights]))
-
-    def __reduce(self, cell: tuple[int, int], fringe: deque) -> int:
-        """Reduces cell's states based on its neighbouring cells in the wave. If the cell's states
-        are indeed reduced (that is, before and after calling this function the number of tiles
-        it may collapse to changes), this cell's neighbours to the fringe stack. Furthermore, the
-        new entropy of this cell is pushed to the entropyq heap.
+        # clear the bitset of the cell, and set only the bit of the chosen tile
+        self._wave[cell] = 0
+        self._wave[cell + (chosen // 64,)] = np.uint64(1) << np.uint64(chosen % 64)
+
+    def __propagate(self, cell: tuple[int, int]) -> int:
+        """Propagate the collapse (or other reduction) of a cell throughout the wave, so that
+        the possible states each cell may collapse to is updated, and the buckets are kept up to
+        date. Return 1 if there is a contradiction, leaving the wave unchanged. Return 0 otherwise.
 
         A cell may collapse during this process, when its number of possible states becomes 1.
-        In the case that the cell has 0 possible states after reduction, a contradiction is reached,
-        and this function returns 1. Otherwise, it returns 0.
+        Every other reduced cell is pushed to the bucket of its new number of states. All
+        reductions are recorded in the latest frame.
 
         Preconditions:
             - 0 < cell[0] < self._wave.shape[0]
             - 0 < cell[1] < self._wave.shape[1]
-            - cells in fringe are valid positions on the wave
         """
-        nb = get_neighbours(cell, self._wave.shape[0], self._wave.shape[1])
-        states = set(self._freq.keys())   # fetch all possible tiles as default collection
-        # update the possible states of the input cell based on neighbours
-        for n in nb:
-            # we need not consider the cells that have self._wave[cell] is None, as these will
-            # not restrict the intersection at all
-            if self._wave[n[0]] is not None:
-                states.intersection_update(set.union(*(self._adj.adjacent(s, n[1]) for s in self._wave[n[0]])))
-
-        # compare new possible cell states to the cell states prior to calling this method;
-        # if they are different, the cell has changed in entropy -- update everything
-        if self._wave[cell] != states:
-            # we update everything accordingly
-            self._wave[cell] = states
-            # Check that a contradiction has not occurred (i.e. the number of states
-            # that the cell may collapse to is 0). If it has, return 1.
-            if len(states) == 0:
-                return 1
-            # furthermore, if there is only one remaining state the cell may occupy,
-            # we may consider it to have collapsed to that cell
-            if len(states) == 1:
-                self._uncollapsed -= 1
-            # note that we know entropy is not np.nan, as cell has reduced states in this branch,
-            # and if len(states) == 1 this cell has collapsed and must not be considered again
-            else:
-                heapq.heappush(self._entropyq, (self.__entropy(cell), cell))
-
-            for n in nb:
-                # NOTE that the same cell may be reduced more than once during a single propagation phase.
-                # This is intentional -- the change in a neighbour during propagation may change a cell,
-                # which in turn may again affect the neighbour!
-                if self._wave[n[0]] is None or len(self._wave[n[0]]) > 1:
-                    fringe.append(n[0])
-
-        # If we have gotten to this point, we have not reached a contradiction with this cell,
-        # so we may return 0.
+        dirty, old = self._buffers[2], self._buffers[3]
+        n = _propagator(self._wave.shape[2])(self._wave, self._tables, self._buffers, cell)
+        if n < 0:
+            return 1
+        self.__record(dirty[:n].copy(), old[:n].copy())
+
+        # Only cells that were uncollapsed are ever reduced, so every reduced cell left with
+        # one state has collapsed during propagation, and must not be considered again.
+        counts = popcount(self._wave[dirty[:n, 0], dirty[:n, 1]])
+        self._uncollapsed -= int(np.count_nonzero(counts == 1))
+        self.__push(dirty[:n], counts)
         return 0
 
-    def __propagate(self, cell: tuple[int, int]) -> int:
-        """Propagate the collapse of a cell throughout the wave, so that the possible
-        states each cell may collapse to is updated, and the entropyq is kept up to
-        date. Return 1 if there is a contradiction. Return 0 otherwise.
-
-        Preconditions:
-            - 0 < cell[0] < self._wave.shape[0]
-            - 0 < cell[1] < self._wave.shape[1]
+    def __undo(self, frame: _Frame) -> None:
+        """Undo the collapse recorded in the input frame, and every reduction since, returning
+        the restored cells to the buckets. The frame must have been the latest frame on the stack,
+        and have been popped from it.
         """
-        # add all neighbours to the collapsed cell to the stack of affected cells
-        # if they are not already collapsed themselves
-        fringe = deque()
-        for n in get_neighbours(cell, self._wave.shape[0], self._wave.shape[1]):
-            if self._wave[n[0]] is None or len(self._wave[n[0]]) > 1:
-                fringe.append(n[0])
+        # restore the cells in reverse order of reduction, so each ends up in its earliest state
+        for cells, states in reversed(frame.changes):
+            self._wave[cells[:, 0], cells[:, 1]] = states
+        self._wave[frame.cell] = frame.states
+        self._uncollapsed = frame.uncollapsed
+
+        cells = np.concatenate([np.array([frame.cell], np.int32)] + [c for c, _ in frame.changes])
+        _refresh(self._wave, self._tables, cells, self._wave.shape[2])
+        self.__push(cells, popcount(self._wave[cells[:, 0], cells[:, 1]]))
+
+    def __backtrack(self) -> None:
+        """Resolve a contradiction reached by the latest collapse, by undoing it and forbidding
+        the tile it chose. If this in turn leads to a contradiction, backtrack further. If there
+        is no collapse left to undo, or the backtracking budget is spent, reset the wave.
+
+        This is called once the latest collapse has led to a contradiction, and the reductions
+        it led to are undone.
+        """
+        # backtracking may undo and redo the latest collapses at length without making progress,
+        # so it is limited by a budget, renewed whenever the wave is closer to collapse than ever
+        self._search.budget -= 1
+        while self._search.budget >= 0 and len(self._search.stack) > 0:
+            frame = self._search.stack.pop()
+            self.__undo(frame)
+
+            # Forbid the tile the cell collapsed to. This reduces the cell with respect to the wave
+            # prior to the collapse, so the reduction is recorded in the frame before it.
+            cell = np.array([frame.cell], np.int32)
+            self.__record(cell, self._wave[frame.cell][None].copy())
+            self._wave[frame.cell + (frame.tile // 64,)] &= ~(np.uint64(1) << np.uint64(frame.tile % 64))
+
+            count = popcount(self._wave[frame.cell])
+            if count == 1:
+                self._uncollapsed -= 1
+            self.__push(cell, np.array([count]))
+            if count > 0 and self.__propagate(frame.cell) == 0:
+                return
 
-        # propagate the collapse to each neighbouring tile while there is anything to propagate
-        while len(fringe) > 0:
-            next_ = fringe.pop()
-            if self.__reduce(next_, fringe) == 1:
-                return 1
-        return 0
+        # there is no collapse left to undo (or no budget left to do so), so we must start over
+        self.__reset()
 
     def generate(self) -> np.ndarray:
-        """Generate and return a wave of size w x h storing the ID of tiles in the output image,
-        using the adjacency and frequency rules stored as a graph and dictionary in this core.
+        """Generate and return a wave of size w x h storing the tile of every cell in the output
+        image as a bitset, using the adjacency and frequency rules stored as bitsets and an array
+        in this core. Bit k of a bitset is set if the cell holds the tile with ID k.
         """
-        # choose the first cell to collapse at random
-        cell = (np.random.randint(0, self._wave.shape[0]), np.random.randint(0, self._wave.shape[1]))
-
         # while there is at least one uncollapsed cell in the output array, continue main loop
         while self._uncollapsed > 0:
-            # Keep popping until the cell you're at is not collapsed. It is possible that
-            # a collapsed cell exists in the queue, as the entropy it is pushed with may have
-            # changed in subsequent cell collapses. We must therefore account for this.
-            # NOTE that before first iteration, cell will be collapsed already, and thus
-            # this condition is guaranteed to be met
-            while self._wave[cell] is not None and len(self._wave[cell]) == 1:
-                cell = heapq.heappop(self._entropyq)[1]   # entropyq stores (entropy, cell) tuple
-            # collapse the lowest entropy cell, and propagate the effects of this collapse
+            # collapse the cell with the fewest states, and propagate the effects of this collapse
+            # NOTE that before the first collapse, all cells are unrestricted and one is chosen at random
+            cell = self.__pop()
             self.__collapse(cell)
 
-            # check for a contradiction -- if there is a contradiction, reset the wave
+            # check for a contradiction -- if there is a contradiction, backtrack
             if self.__propagate(cell) == 1:
-                self._entropyq = []
-                self._wave = np.ndarray((self._wave.shape[0], self._wave.shape[1]), set)
-                self._uncollapsed = self._wave.shape[0] * self._wave.shape[1]
+                self.__backtrack()
+            elif self._uncollapsed < self._search.best:
+                self._search.best = self._uncollapsed
+                self._search.budget = _BUDGET
 
             # at the end of every step, visualize the updated wave
-            self._visual.draw(self._wave)
+            self._visual.draw(self._wave, self._uncollapsed == 0)
 
         return self._wave
 
@@ -234,7 +548,7 @@ if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'extra-imports': ['numpy', 'heapq', 'collections', 'wfc_graph', 'wfc_utilities', 'wfc_visual'],
+        'extra-imports': ['collections', 'functools', 'numpy', 'numba', 'wfc_utilities', 'wfc_visual'],
         'allowed-io': [],
         'max-line-length': 120
     })
@@ -12,16 +12,18 @@ Copyright 2024, Stefan Barna, All rights reserved.
 from PIL import Image
 import numpy as np
 
-from wfc_graph import Graph
-from wfc_utilities import hash_arr, get_neighbours
+from wfc_utilities import neighbour_table, pack_bits
 
 
-def extract(path: str, n: int = 2) -> (dict[np.int64, np.array], np.ndarray[np.int64]):
+def extract(path: str, n: int = 2) -> (np.ndarray[np.uint8], np.ndarray[np.int32]):
     """Extract image data from the Image found at input path.
-    Return a dictionary mapping tile IDs to the n x n tiles extracted from the input image.
+    Return a palette array mapping tile IDs to the n x n tiles extracted from the input image.
     Return also a numpy array of dimensions equal to input image, where cell [i,j] is the ID
     of the n x n tile whose upper left corner is the pixel [i, j] within the input image.
 
+    Tile IDs are the integers 0, ..., T - 1, where T is the number of distinct tiles in the image,
+    so that the palette is of shape (T, 3).
+
     Preconditions:
         - path is a valid image path
         - if img is the image in path, n <= min(img width, img height)
@@ -30,8 +32,6 @@ def extract(path: str, n: int = 2) -> (dict[np.int64, np.array], np.ndarray[np.i
     # open image and grab dimensions
     with Image.open(path) as img:
         w, h = img.size
-        tileset = np.zeros((h, w), np.int64)
-        tileid = {}
 
         # setup image array with padding to allow reading N x N tiles that
         # exceed image boundaries and wrap to the other side
@@ -40,59 +40,51 @@ def extract(path: str, n: int = 2) -> (dict[np.int64, np.array], np.ndarray[np.i
         # aimg has three dimensions: height, width, and pixel description
         # we only wish to wrap around height and width
 
-        # iterate over image columns
-        for i in range(h):
-            # iterate over image row
-            for j in range(w):
-                # store tile in dictionary -- if already present nothing will happen
-                # NOTE: we store only the TOP-LEFT pixel of the tile in the dictionary.
-                # This is because, for every tile placed in the output grid, only a single
-                # pixel of the tile may be introduced to the image. We choose the top-left
-                # for convenience. We do, however, need the entire tile for hashing.
-                key = hash_arr(aimg[i:i + n, j:j + n])
-                tileid[key] = aimg[i, j]
-                # store a reference to the N x N tile in tiles via the hash key
-                tileset[i, j] = key
-
-    return tileid, tileset
-
-
-def gen_rules(tileset: np.ndarray[np.int64]) -> (Graph, dict):
-    """Generate and return directed multigraph based on adjacencies in tiles.
-    Vertices are all keys within tileid. Two tiles adjacent in the input tiles array
-    T1 and T2 are represented by two edge connections: one from T1 to T2, storing
-    the direction (L/R/U/D) T2 is with respect to T1, and one from T2 to T1 analogously.
-    Return also a dictionary storing the frequency of each tile, mapping tileID -> freq.
+    # view the N x N tile at every pixel of the image as a flat row of pixel data; rows are
+    # ordered as pixels in the image, so row i * w + j is the tile whose upper left corner is [i, j]
+    tiles = np.lib.stride_tricks.sliding_window_view(aimg, (n, n, 3)).reshape(h * w, n * n * 3)
+    # identical tiles are given the same ID, being the index of the tile among the unique tiles
+    unique, inverse = np.unique(tiles, axis=0, return_inverse=True)
+    tileset = inverse.reshape(h, w).astype(np.int32)
+
+    # NOTE: we store only the TOP-LEFT pixel of the tile in the palette.
+    # This is because, for every tile placed in the output grid, only a single
+    # pixel of the tile may be introduced to the image. We choose the top-left
+    # for convenience. We do, however, need the entire tile for identification.
+    palette = np.ascontiguousarray(unique[:, :3])
+
+    return palette, tileset
+
+
+def gen_rules(tileset: np.ndarray[np.int32]) -> (np.ndarray[np.uint64], np.ndarray[np.float64]):
+    """Generate and return the adjacency rules of the tiles in tileset, as an array of bitsets
+    allowed of shape (4, T, ceil(T / 64)), where T is the number of unique tiles.
+
+    Bit k2 of allowed[d, k1] is set if and only if the tiles with ID k1 and k2 are adjacent in
+    tileset, with the latter lying in direction index d (LEFT/RIGHT/UP/DOWN) with respect to the
+    former. Return also an array of shape (T,) storing the frequency of each tile by tile ID.
 
     Preconditions:
-        - all(len(tiles[i]) == len(tiles[0]) for i in range(len(tiles)))
+        - tileset contains every tile ID 0, ..., T - 1, as produced by extract
     """
-    # determine unique tiles and frequencies
-    tiles, counts = np.unique(tileset, return_counts=True)
-    freq = dict(zip(tiles, counts))
-
-    # add all unique tiles as vertices in the graph
-    adj = Graph(set(tiles))
-    w, h = tileset.shape[1], tileset.shape[0]
+    # determine tile frequencies
+    freq = np.bincount(tileset.ravel()).astype(np.float64)
 
-    # iterate over every column
-    for i in range(h):
-        # iterate over every row
-        for j in range(w):
-            nb = get_neighbours((i, j), h, w)
-            # add adjacency data for every tile adjacent to the current one in cardinal directions
-            # using direction of the target wrt. the current tile
-            for n in nb:
-                adj.add_edge(tileset[n[0]], tileset[i, j], n[1])
+    # For every direction, pair the tile of every cell with the tile of the neighbour with
+    # respect to which it lies in that direction. Each such pair is a permitted adjacency.
+    nb_i, nb_j = neighbour_table(tileset.shape[0], tileset.shape[1])
+    allowed = np.zeros((4, freq.size, freq.size), bool)
+    for d in range(4):
+        allowed[d, tileset[nb_i[..., d], nb_j[..., d]], tileset] = True
 
-    return adj, freq
+    return pack_bits(allowed), freq
 
 
 if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'extra-imports': ['PIL', 'numpy', 'wfc_graph', 'wfc_utilities'],
+        'extra-imports': ['PIL', 'numpy', 'wfc_utilities'],
         'allowed-io': [],
         'max-line-length': 120
     })
@@ -11,29 +11,65 @@ Copyright 2024, Stefan Barna, All rights reserved.
 """
 import numpy as np
 
+# Direction indices. Neighbourhood data is stored as the direction of a cell with respect to
+# its neighbour (e.g. LEFT if the cell is to the left of the neighbour). The opposite of
+# direction d is d ^ 1.
+LEFT, RIGHT, UP, DOWN = 0, 1, 2, 3
 
-def hash_arr(arr: np.array) -> int:
-    """Return a hash value for the input numpy array.
-    WARNING. mutating the array after hashing changes the hash value. Once hashed,
-    do not mutate an array that is to be accessed by its hash value.
+
+def neighbour_table(h: int, w: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return the neighbours of every cell on a grid of height h and width w as two arrays
+    nb_i and nb_j of shape (h, w, 4), such that (nb_i[i, j, d], nb_j[i, j, d]) is the neighbour
+    with respect to which cell (i, j) lies in direction d. This accounts for cells on grid border.
+
+    Preconditions:
+        - h > 0
+        - w > 0
+    """
+    ii, jj = np.meshgrid(np.arange(h), np.arange(w), indexing='ij')
+    nb_i = np.empty((h, w, 4), np.int32)
+    nb_j = np.empty((h, w, 4), np.int32)
+    nb_i[..., LEFT], nb_j[..., LEFT] = ii, (jj + 1) % w
+    nb_i[..., RIGHT], nb_j[..., RIGHT] = ii, (jj - 1) % w
+    nb_i[..., UP], nb_j[..., UP] = (ii + 1) % h, jj
+    nb_i[..., DOWN], nb_j[..., DOWN] = (ii - 1) % h, jj
+    return nb_i, nb_j
+
+
+def pack_bits(arr: np.ndarray) -> np.ndarray:
+    """Return the boolean input array packed into a bitset along its last axis.
+    Bit k of the bitset is stored in word k // 64 of the output, at position k % 64,
+    so that an input of shape (..., t) yields an output of shape (..., ceil(t / 64))
+    with dtype uint64. Bits beyond t are set to 0.
+    """
+    words = -(-arr.shape[-1] // 64)
+    # pad the bytes of each bitset to a whole number of 64-bit words before viewing
+    # NOTE: we use explicitly little-endian words so bit k of the bytes is bit k of the words
+    packed = np.packbits(arr, axis=-1, bitorder='little')
+    pad = [(0, 0)] * (arr.ndim - 1) + [(0, words * 8 - packed.shape[-1])]
+    return np.ascontiguousarray(np.pad(packed, pad)).view('<u8').astype(np.uint64)
+
+
+def unpack_bits(bits: np.ndarray, t: int) -> np.ndarray:
+    """Return the bitset input array unpacked into a boolean array along its last axis.
+    This is the inverse of pack_bits, where t is the number of bits stored in each bitset.
+
+    Preconditions:
+        - bits.dtype == np.uint64
+        - 0 <= t <= 64 * bits.shape[-1]
     """
-    return hash(np.array_str(arr))
+    unpacked = np.unpackbits(bits.astype('<u8').view(np.uint8), axis=-1, bitorder='little')
+    return unpacked[..., :t].astype(bool)
 
 
-def get_neighbours(cell: tuple[int, int], h: int, w: int) -> set[tuple[tuple[int, int], str]]:
-    """Return the coordinates of the neighbours to the input cell on a grid
-    of height h and width w. This method accounts for cells on grid border.
-    These coordinates are bound to directional data representing the position
-    of the input cell with respect to the neighbour (e.g. L for left).
+def popcount(bits: np.ndarray) -> np.ndarray:
+    """Return the number of set bits in each bitset of the input array, counted
+    along its last axis.
 
     Preconditions:
-        - 0 < cell[0] < h
-        - 0 < cell[1] < w
+        - bits.dtype == np.uint64
     """
-    return {(((cell[0] - 1) % h, cell[1]), 'D'),
-            (((cell[0] + 1) % h, cell[1]), 'U'),
-            ((cell[0], (cell[1] - 1) % w), 'R'),
-            ((cell[0], (cell[1] + 1) % w), 'L')}
+    return np.unpackbits(bits.astype('<u8').view(np.uint8), axis=-1).sum(axis=-1)
 
 
 if __name__ == '__main__':
@@ -13,34 +13,39 @@ from PIL import Image
 import numpy as np
 import pygame
 
+from wfc_utilities import unpack_bits
+
+# the minimum number of milliseconds between two draws under the 'auto' flag (about 60 frames per second)
+FRAME_MS = 16
+
 
 class Visual:
     """A wave visualizer, responsible for graphically representing the condition of
     cells in any wave by interpolating over possible states they may collapse to.
 
     Representation Invariants:
-        - all(0 <= p <= 255 for p in self._default)
-        - len(self._default) == 3
+        - self._tile_rgb.shape[1] == 3
         - self._flag in {'auto', 'manual'}
-        - self._tsize > 0
+        - self._pixels.shape[1] == self._pixels.shape[3] > 0
     """
     # Private Instance Attributes:
     #   - _screen: The pygame surface to which we visualize any wave
-    #   - _tileid: A mapping between tileIDs and tile pixel data
-    #   - _default: The default pixel data; determined by interpolating between the
-    #               pixel data of all possible tiles
+    #   - _tile_rgb: The pixel data of every tile, ordered by the tile's index in wave bitsets
+    #   - _pixels: The pixel data of the screen, of shape (h, tsize, w, tsize, 3), such that
+    #       _pixels[i, :, j] are the pixels of cell [i, j]; reused across draws
     #   - _flag: The set of flags considered when visualizing any wave
+    #   - _last_draw: The time, in milliseconds since pygame was initialized, of the last draw
     #   - _debug: Whether to feature debug visuals
     _screen: pygame.Surface
-    _tileid: dict[np.int64, np.array]
-    _default: np.array
-    _tsize: int
+    _tile_rgb: np.ndarray
+    _pixels: np.ndarray
 
     # flags and behaviour control
     _flag: str
     _debug: bool
+    _last_draw: int
 
-    def __init__(self, w: int, h: int, tileid: dict[np.int64, np.array],
+    def __init__(self, w: int, h: int, palette: np.ndarray,
                  tsize: int = 8, flag: str = 'off', debug: bool = False) -> None:
         """Initialize a new visualizer onto a surface compatible with any wave of the given
         width w and height h. Accept an optional tsize tile size parameter indicating the
@@ -50,7 +55,7 @@ class Visual:
         Visual accepts an optional flag that control the behaviour of the draw method
             - 'off' (default) disables the visualizer altogether
             - 'manual' pauses after visualization to await keyboard input
-            - 'auto' enables a pause for a fixed period after visualization
+            - 'auto' refreshes the visualization at most once every FRAME_MS milliseconds
         It furthermore accepts an optional parameter that enables debug visuals when toggled.
         Debug visuals identify which cells have collapsed through red indicators.
 
@@ -63,52 +68,54 @@ class Visual:
         """
         if flag == 'off':
             # if the visualizer is turned off, the draw function is disabled -- we do nothing
-            self.draw = lambda x: None
+            self.draw = lambda wave, final=False: None
         else:
             # otherwise, we initialize pygame and load relevant information
             pygame.init()
             pygame.display.set_caption("Wave")
 
             self._screen = pygame.display.set_mode((w * tsize, h * tsize))
-            self._tileid = tileid
-            self._tsize = tsize
+            self._tile_rgb = palette.astype(np.int64)
             self._flag = flag
             self._debug = debug
+            self._last_draw = -FRAME_MS
+            self._pixels = np.empty((h, tsize, w, tsize, 3), np.uint8)
 
-            # determine average pixel data through averaging pixel data of all tiles in tileid
-            self._default = np.zeros(3)
-            for i in range(3):
-                self._default[i] = sum(tileid[key][i] for key in tileid) // len(tileid)
-
-    def draw(self, wave: np.ndarray) -> None:
+    def draw(self, wave: np.ndarray, final: bool = False) -> None:
         """Draw the input wave by translating the tileID data it stores into pixel data.
+        Under the 'auto' flag, the draw is skipped if the previous one was less than FRAME_MS
+        milliseconds ago, unless final is True (i.e. the wave has been entirely collapsed).
 
         Preconditions:
-        - wave[i, j] stores a list of all tileIDs feasible for cell [i, j], or is None if
-            cell [i, j] may take on any tileID (i.e. is unrestricted)
-        - every element of wave[i, j] is a tileID stored in self._tileid
-        - all(s in self._tileid for i in range(wave.shape[0]) for j in range(wave.shape[1]) for s in wave[i, j])
-        - all(wave.shape[i] == self._screen.get_size()[i] // self._tsize for i in range(2))
+        - wave[i, j] is a bitset of all tiles feasible for cell [i, j], where bit k is the
+            tile ID k, whose pixel data is palette[k]
+        - wave.shape[0] == self._pixels.shape[0]
+        - wave.shape[1] == self._pixels.shape[2]
         """
-        # set background colour to the default tile colour
-        self._screen.fill(self._default)
-        # iterate over every element of the wave
-        for i in range(wave.shape[0]):
-            for j in range(wave.shape[1]):
-                # if the tile at this index is not default (wave[i, j] is None)
-                # colour it in either based on the tile it has collapsed to, or
-                # as an average of the tiles it could collapse to
-                if wave[i, j] is not None:
-                    col = np.zeros(3)
-                    for k in range(3):
-                        col[k] = sum(self._tileid[key][k] for key in wave[i, j]) // len(wave[i, j])
-                    pygame.draw.rect(self._screen, col, (j * self._tsize, i * self._tsize,
-                                                         self._tsize, self._tsize))
-
-                    # if the debug visual environment is enabled, indicate whether this cell is collapsed
-                    if self._debug and len(wave[i, j]) == 1:
-                        pygame.draw.rect(self._screen, (255, 0, 0), (j * self._tsize, i * self._tsize,
-                                                                     self._tsize, self._tsize), 1)
+        # the human eye would not perceive more frequent refreshes, so we skip them
+        now = pygame.time.get_ticks()
+        if self._flag == 'auto' and not final and now - self._last_draw < FRAME_MS:
+            return
+        self._last_draw = now
+
+        bits = unpack_bits(wave, self._tile_rgb.shape[0])
+        counts = bits.sum(axis=-1)
+        # colour every cell in either based on the tile it has collapsed to, or as an average of
+        # the tiles it could collapse to (which, for an unrestricted cell, is the default colour)
+        colours = (bits @ self._tile_rgb) // np.maximum(counts, 1)[..., None]
+        # scale every cell up to tsize x tsize pixels by broadcasting into the pixel buffer
+        self._pixels[...] = colours[:, None, :, None]
+
+        # if the debug visual environment is enabled, indicate whether each cell is collapsed
+        # by outlining the cell in red
+        if self._debug:
+            ci, cj = np.nonzero(counts == 1)
+            self._pixels[ci, 0, cj] = self._pixels[ci, -1, cj] = (255, 0, 0)
+            self._pixels[ci, :, cj, 0] = self._pixels[ci, :, cj, -1] = (255, 0, 0)
+
+        # NOTE: pygame surfaces are indexed by (x, y), so we swap the (row, column) axes
+        width, height = self._screen.get_size()
+        pygame.surfarray.blit_array(self._screen, self._pixels.reshape((height, width, 3)).swapaxes(0, 1))
         pygame.display.flip()
         # await keyboard input if manual flag is toggled
         if self._flag == 'manual':
@@ -117,28 +124,21 @@ class Visual:
                 continue
 
 
-def render(path: str, tileid: dict[np.int64, np.array], wave: np.ndarray) -> None:
-    """Render the wave of tileIDs into an output image at the location given by
-    path, where the tileID corresponds to the pixel stored in the tileid mapping.
+def render(path: str, palette: np.ndarray, wave: np.ndarray) -> None:
+    """Render the wave of tile bitsets into an output image at the location given by
+    path, where bit k of a bitset corresponds to tile ID k, whose pixel is stored in
+    the palette array at palette[k].
 
-    As stated in the preconditions, all cells in the wave must be singleton sets,
-    where each element is found in the input tileid mapping.
+    As stated in the preconditions, all cells in the wave must have exactly one bit set.
 
     Preconditions:
         - path is a valid image path
-        - len(wave.shape) == 2
-        - all(len(wave[i, j]) == 1 for i in range(wave.shape[0]) for j in range(wave.shape[1]))
-        - all(s in self._tileid for i in range(wave.shape[0]) for j in range(wave.shape[1]) for s in wave[i, j])
+        - len(wave.shape) == 3
+        - all(popcount(wave[i, j]) == 1 for i in range(wave.shape[0]) for j in range(wave.shape[1]))
     """
-    # we set the output ndarray to contain 4 elements per tile: RGBA
-    out = np.ndarray((wave.shape[0], wave.shape[1], 3), np.uint8)
-    # iterate over every element in the wave and translate it to a pixel
-    for i in range(wave.shape[0]):
-        for j in range(wave.shape[1]):
-            # casting to set here is, for the most part, an unnecessary step
-            # as we know all slements of wave are singleton sets (precondition);
-            # unfortunately, it is otherwise picked up as an error in the editor
-            out[i, j] = tileid[set(wave[i, j]).pop()]
+    # the only set bit of a collapsed cell is the index of its tile, which we use to
+    # translate every cell to a pixel (RGB) at once
+    out = palette[np.argmax(unpack_bits(wave, palette.shape[0]), axis=-1)]
     # render the output image at the given location
     img = Image.fromarray(out)
     img.save(path)
@@ -148,7 +148,7 @@ if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'extra-imports': ['PIL', 'numpy', 'pygame'],
+        'extra-imports': ['PIL', 'numpy', 'pygame', 'wfc_utilities'],
         'allowed-io': [],
         'max-line-length': 120
     })